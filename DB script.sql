@@ -8,6 +8,8 @@ if object_id('SlackUserToEvent') is not null
 	drop table SlackUserToEvent;
 if object_id('CreateSlackUser') is not null
 	drop procedure CreateSlackUser
+if object_id('UpdateSlackUser') is not null
+	drop procedure UpdateSlackUser
 if object_id('AddUserToEvent') is not null
 	drop procedure AddUserToEvent
 if object_id('CreateEvent') is not null
@@ -33,7 +35,10 @@ create table [Event]
 	EventID				int				primary key identity(1,1),
 	EventDescription	varchar(500),
 	EventDate			date			default('2017-01-01'),
-	EventTime			time			default('00:00:00')
+	EventTime			time			default('00:00:00'),
+	RecurrenceFrequency	varchar(10)		null check (RecurrenceFrequency in ('daily', 'weekly', 'monthly')),
+	RecurrenceUntil		date			null,
+	RecurrenceCount		int				null
 	)
 
 create table [SlackUserToEvent]
@@ -61,6 +66,23 @@ begin
 		select -1
 end
 
+go
+create proc UpdateSlackUser
+(
+	@UserID		varchar(15),
+	@Username	varchar(50)
+)
+as
+begin
+	if (exists(select SlackUserID from SlackUser where SlackUserID = @UserID))
+		update SlackUser
+		set [Name] = @Username
+		where SlackUserID = @UserID
+	else
+		insert into SlackUser
+		values (@UserID, @Username)
+end
+
 go
 create proc AddUserToEvent
 (
@@ -82,17 +104,23 @@ create proc CreateEvent
 	@UserID			varchar(15),
 	@Description	varchar(500),
 	@Date			date,
-	@Time			time
+	@Time			time,
+	@Frequency		varchar(10) = null,
+	@Until			date = null,
+	@Count			int = null
 )
 as
 begin
 	declare @EventID int
 
 	insert into [Event]
-	values (@Description, @Date, @Time)
+	values (@Description, @Date, @Time, @Frequency, @Until, @Count)
 
 	set @EventID = @@IDENTITY
 	exec AddUserToEvent @UserID, @EventID
+
+	-- the ID is part of the text of the creator's Slack reminder
+	select @EventID as EventID
 end
 
 go
@@ -103,16 +131,23 @@ create proc GetUserEvent
 )
 as
 begin
-	select [Event].EventID, EventDescription, EventDate, EventTime
+	-- the attendees are returned as a comma separated list of IDs so we don't need another round trip for them
+	select top 1 [Event].EventID, EventDescription, EventDate, EventTime, RecurrenceFrequency, RecurrenceUntil, RecurrenceCount,
+		stuff((select ',' + Attendee.SlackUserID from SlackUserToEvent Attendee
+			   where Attendee.EventID = [Event].EventID for xml path('')), 1, 1, '') as Attendees
 	from [Event] join SlackUserToEvent		on [Event].EventID = SlackUserToEvent.EventID
 	where SlackUserID = @UserID and [Event].EventID > @EventID
+	order by [Event].EventID
 end
 
 go
 create proc GetNextEvent
 (	@EventID int	) as
 begin
-	select EventID, EventDescription, EventDate, EventTime
+	-- the attendees are returned as a comma separated list of IDs so we don't need another round trip for them
+	select EventID, EventDescription, EventDate, EventTime, RecurrenceFrequency, RecurrenceUntil, RecurrenceCount,
+		stuff((select ',' + Attendee.SlackUserID from SlackUserToEvent Attendee
+			   where Attendee.EventID = [Event].EventID for xml path('')), 1, 1, '') as Attendees
 	from [Event]
 	where EventID = (select top 1 EventID from SlackUserToEvent where EventID > @EventID order by EventID)
 end
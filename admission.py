@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Overload protection for the EventScheduler app. Slack gives up on a request after 3 seconds and retries it, so once
+the database or Slack API start queueing up it is better to turn requests away straight away with a cheap reply than
+to answer all of them late.
+
+Each guarded route tracks how many requests it is handling and how long they have recently taken, and the database and
+the Slack API track how long each call to them recently took. When too many requests are in flight, or the route or one
+of the dependencies it needs has been slow enough that fewer are allowed, new ones are shed. The database and the Slack
+API each also have a circuit breaker that opens after a run of failures, so requests fail fast until the dependency is
+healthy again.
+
+It is configured with environment variables:
+    EVENTBOT_MAX_IN_FLIGHT          requests each route handles at once, 8 by default
+    EVENTBOT_LATENCY_BUDGET_MS      recent latency of a route, or of a call to a dependency it needs, above which the
+                                    route allows fewer requests, 2000 by default
+    EVENTBOT_BREAKER_FAILURES       failures in a row that open a circuit breaker, 5 by default
+    EVENTBOT_BREAKER_RESET_S        seconds an open circuit breaker waits before trying again, 30 by default
+"""
+import contextlib
+import functools
+import os
+import threading
+import time
+
+
+class Unavailable(Exception):
+    """Raised when a request is shed or a dependency's circuit breaker is open."""
+
+
+class Stats(object):
+    """Counts the requests in flight and keeps an exponentially weighted moving average of their latency."""
+
+    def __init__(self, alpha = 0.2):
+        super(Stats, self).__init__()
+        self.alpha = alpha
+        self.in_flight = 0
+        self.latency = 0.0      # seconds
+        self._lock = threading.Lock()
+
+    def enter(self):
+        """
+        Counts a request or call that has started.
+        """
+        with self._lock:
+            self.in_flight += 1
+
+    def exit(self, seconds):
+        """
+        Counts a request or call that has finished and adds its latency to the moving average.
+        :param seconds: float
+                How long it took.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            self.latency = seconds if not self.latency else self.alpha * seconds + (1 - self.alpha) * self.latency
+
+
+class Dependency(object):
+    """
+    Tracks the latency of the calls made to a service the app depends on, such as the database or the Slack API, and
+    opens a circuit breaker after a number of failures in a row. While it is open, calls fail fast with Unavailable.
+    Once reset_after seconds have passed, a single trial call is let through; if it succeeds the breaker closes,
+    otherwise it opens again.
+    """
+
+    def __init__(self, name, errors = (Exception,), failures = 5, reset_after = 30.0, clock = time.time):
+        super(Dependency, self).__init__()
+        self.name = name
+        self.errors = errors            # the exceptions that count as the dependency failing
+        self.max_failures = failures
+        self.reset_after = reset_after
+        self.clock = clock
+        self.stats = Stats()
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False             # whether a trial call is in progress while the breaker is half open
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        :return: 'closed' while calls are let through, 'open' while they fail fast, or 'half-open' once reset_after
+                seconds have passed and a trial call may be made
+        """
+        if self.opened_at is None:
+            return 'closed'
+        elif self.clock() - self.opened_at < self.reset_after:
+            return 'open'
+        return 'half-open'
+
+    def available(self):
+        """
+        Checks whether a call would be let through right now, without starting one.
+        :return: bool
+        """
+        state = self.state
+        return state == 'closed' or (state == 'half-open' and not self._trial)
+
+    @contextlib.contextmanager
+    def guard(self):
+        """
+        Wraps a call to the dependency, recording its latency and whether it failed.
+        :raises Unavailable: if the circuit breaker is open.
+        """
+        with self._lock:
+            state = self.state
+            if state == 'open' or (state == 'half-open' and self._trial):
+                raise Unavailable('%s is unavailable' % self.name)
+            self._trial = state == 'half-open'
+
+        self.stats.enter()
+        started = self.clock()
+        try:
+            yield
+        except self.errors:
+            self._failed()
+            raise
+        except Exception:
+            self._succeeded()       # the dependency answered, the error is ours
+            raise
+        else:
+            self._succeeded()
+        finally:
+            self.stats.exit(self.clock() - started)
+
+    def _failed(self):
+        """
+        Counts a failed call, and opens the breaker after max_failures in a row or when the trial call failed.
+        """
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.max_failures:
+                self.opened_at = self.clock()
+            self._trial = False
+
+    def _succeeded(self):
+        """
+        Closes the breaker after a call that the dependency answered.
+        """
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+
+class AdmissionController(object):
+    """
+    Decides whether a route takes on another request. Each route may handle max_in_flight requests at once, and that
+    limit shrinks in proportion when the recent latency of the route, or of the calls to a dependency it needs, goes
+    over the latency budget, down to one request at a time so the latency can recover.
+    """
+
+    def __init__(self, max_in_flight = 8, latency_budget = 2.0, clock = time.time):
+        super(AdmissionController, self).__init__()
+        self.max_in_flight = max_in_flight
+        self.latency_budget = latency_budget    # seconds
+        self.clock = clock
+        self.routes = {}        # route -> Stats
+        self._lock = threading.Lock()
+
+    def limit(self, route, dependencies = ()):
+        """
+        Works out how many requests a route may handle at once given its recent latency and that of its dependencies.
+        :param route: str
+                The name of the route.
+        :param dependencies: tuple
+                The Dependency objects the route needs.
+        :return: int
+        """
+        stats = self.routes.get(route)
+        latency = max([stats.latency if stats else 0.0] + [dependency.stats.latency for dependency in dependencies])
+        if latency <= self.latency_budget:
+            return self.max_in_flight
+        return max(1, int(self.max_in_flight * self.latency_budget / latency))
+
+    @contextlib.contextmanager
+    def admit(self, route, dependencies = ()):
+        """
+        Lets a request into a route, or sheds it.
+        :param route: str
+                The name of the route.
+        :param dependencies: tuple
+                The Dependency objects the route needs. If any of them is unavailable the request is shed, and while
+                any of them is slow the route allows fewer requests.
+        :raises Unavailable: if the request is shed.
+        """
+        with self._lock:
+            stats = self.routes.setdefault(route, Stats())
+            if stats.in_flight >= self.limit(route, dependencies):
+                raise Unavailable('%s is busy' % route)
+            for dependency in dependencies:
+                if not dependency.available():
+                    raise Unavailable('%s is unavailable' % dependency.name)
+            stats.enter()
+
+        started = self.clock()
+        try:
+            yield
+        finally:
+            stats.exit(self.clock() - started)
+
+    def guard(self, route, busy, dependencies = ()):
+        """
+        Decorates a Flask view so that it sheds requests when the route is overloaded or a dependency is down. The busy
+        reply asks the user to try again, so once the view has saved something it must handle Unavailable itself.
+        :param route: str
+                The name of the route.
+        :param busy: function
+                Builds the cheap reply sent back when a request is shed.
+        :param dependencies: tuple or function
+                The Dependency objects the route needs, or a function that returns the ones the current request needs.
+        :return: The decorator
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                try:
+                    with self.admit(route, dependencies() if callable(dependencies) else dependencies):
+                        return view(*args, **kwargs)
+                except Unavailable as e:
+                    return busy(e)
+            return wrapper
+        return decorator
+
+
+controller = AdmissionController(int(os.environ.get('EVENTBOT_MAX_IN_FLIGHT', 8)),
+                                 float(os.environ.get('EVENTBOT_LATENCY_BUDGET_MS', 2000)) / 1000)
+database = Dependency('The database',
+                      failures = int(os.environ.get('EVENTBOT_BREAKER_FAILURES', 5)),
+                      reset_after = float(os.environ.get('EVENTBOT_BREAKER_RESET_S', 30)))
+slack = Dependency('Slack',
+                   failures = int(os.environ.get('EVENTBOT_BREAKER_FAILURES', 5)),
+                   reset_after = float(os.environ.get('EVENTBOT_BREAKER_RESET_S', 30)))
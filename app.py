@@ -3,13 +3,70 @@
 A routing layer for the onboarding bot tutorial built using
 [Slack's Events API](https://api.slack.com/events-api) in Python
 """
+import admission
+import functools
+import hmac
 import json
-import bot
-from flask import Flask, request, make_response, render_template
+from flask import Flask, Response, request, make_response, render_template, jsonify, stream_with_context
+import os
+from profiling import profiler
 import re
+import threading
 
 app = Flask(__name__)   # create a Flask application to receive and send json messages
-eventBot = bot.Bot()    # instantiate a bot to handle incoming requests
+
+
+class LazyBot(object):
+    """
+    Stands in for the bot until it is first used. The bot module pulls in pymssql and the Slack client, so importing and
+    creating it is put off until a request needs it, or until prewarm does it in the background.
+    """
+
+    def __init__(self):
+        super(LazyBot, self).__init__()
+        self._bot = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Creates the bot the first time it is needed.
+        :return: The Bot object handling incoming requests
+        """
+        if self._bot is None:
+            with self._lock:
+                if self._bot is None:   # another thread may have created it while we were waiting for the lock
+                    import bot
+                    self._bot = bot.Bot()
+        return self._bot
+
+    def __getattr__(self, name):
+        if name.startswith('_'):    # never create the bot for our own private attributes
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+
+eventBot = LazyBot()    # instantiate a bot to handle incoming requests
+
+
+def prewarm():
+    """
+    Creates the bot and opens its Slack and database connections on a background thread, so the first request doesn't
+    have to wait for them. A misconfigured database or Slack app is reported without stopping the application.
+    :return: The thread doing the work
+    """
+    def warm():
+        try:
+            eventBot.prewarm()
+        except Exception as e:
+            print 'Failed to prewarm eventBot: %s' % e
+
+    thread = threading.Thread(target=warm, name='prewarm')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+if os.environ.get('EVENTBOT_PREWARM'):
+    prewarm()
 
 
 def _event_handler(event_type, slack_event):
@@ -23,9 +80,14 @@ def _event_handler(event_type, slack_event):
     """
     # When a user first joins a team, the type of event will be team_join
     if event_type == 'team_join':
-        eventBot.welcome(slack_event['user'])        # Send the welcoming message
+        eventBot.welcome(slack_event['event']['user'])      # Send the welcoming message
         return make_response('Welcome Message Sent', 200,)
 
+    # When a user changes their profile, keep the name we display for them up to date
+    elif event_type == 'user_change':
+        eventBot.update_user(slack_event['event']['user'])
+        return make_response('User Updated', 200,)
+
     # When a user has invoked the /event slash command and wants to know how to use it
     elif event_type == 'help':
         message = eventBot.show_help()
@@ -78,7 +140,11 @@ def thanks():
     # Let's grab that temporary authorization code Slack's sent us from the request's parameters.
     code_arg = request.args['code']
     # The bot's auth method to handle exchanging the code for an OAuth token
-    eventBot.auth(code_arg)
+    try:
+        eventBot.auth(code_arg)
+    except admission.Unavailable as e:
+        return make_response('%s, please try installing EventBot again in a moment.' % e, 503,
+                             {'X-Slack-No-Retry': 1})
     return render_template('thanks.html')
 
 
@@ -104,14 +170,87 @@ def listen():
         if 'event' in slack_event:
             event_type = slack_event['event']['type']
             # Then handle the event by event_type and have your bot respond
-            return _event_handler(event_type, slack_event)
+            try:
+                return _event_handler(event_type, slack_event)
+            except admission.Unavailable as e:
+                # Slack retries an event that fails, which would only add to the load, so it is dropped instead
+                print 'Dropping %s event: %s' % (event_type, e)
+                return make_response('%s, dropping the event' % e, 503, {'X-Slack-No-Retry': 1})
 
     # If our bot hears things that are not events we've subscribed to, send a quirky but helpful error response
     return make_response('[NO EVENT IN SLACK REQUEST] These are not the droids you\'re looking for.', 404,
                          {'X-Slack-No-Retry': 1})
 
 
+def _slack_request():
+    """
+    Gets the fields Slack sent with the current /event or /button request. Message buttons send them as JSON.
+    :return: dict
+    """
+    if 'payload' in request.values:
+        return json.loads(request.values['payload'])
+    return request.values
+
+
+def _request_user():
+    """
+    Gets the ID of the Slack user who sent the current /event or /button request, so profiles can be found by user.
+    :return: str
+    """
+    if 'payload' in request.values:
+        return json.loads(request.values['payload'])['user']['id']
+    return request.values.get('user_id')
+
+
+def _verified(view):
+    """
+    Decorates the /event and /button views so that requests that didn't come from Slack are turned away before they
+    are admitted, and can't take the place of real requests.
+    :param view: function
+        The Flask view
+    :return: The decorated view
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        response = check_request_token(_slack_request())
+        if response:
+            return response
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _event_dependencies():
+    """
+    Gets the dependencies of the /event command being handled. Only `/event all` and `/event me` read from the
+    database, help and new are answered without it.
+    :return: tuple
+    """
+    if re.match('all|me', request.values.get('text', '')):
+        return (admission.database,)
+    return ()
+
+
+def _busy(error):
+    """
+    Builds the cheap reply sent back when a request is shed because the app is overloaded or the database or Slack is
+    down. It still has a 200 status so Slack shows it to the user instead of retrying the request.
+    :param error: admission.Unavailable
+        Why the request was shed
+    :return: Response object with 200 - ok
+    """
+    print 'Shedding request: %s' % error
+    return jsonify({
+        'response_type': 'ephemeral',       # by making this ephemeral, only the user can see it
+        'text': 'EventBot is busy right now, please try again in a moment.',
+        'content-type': 'application/json',
+        'replace_original': False           # keep the original message so its buttons can be clicked again
+    })
+
+
 @app.route('/event', methods=['POST'])
+@_verified      # Verify that the request came from Slack
+@admission.controller.guard('/event', _busy, _event_dependencies)
+@profiler.profile('/event', _request_user)
 def slash_event():
     """
     ============ Slack Slash Event Invocation ===========
@@ -121,28 +260,46 @@ def slash_event():
     """
     slack_event = request.values
 
-    # Verify that the request came from Slack
-    if not check_token(slack_event):
-        # if text starts with 'help', send message for more information on how to use command
-        if re.match('help', slack_event['text']):
-            event_type = 'help'
-            return _event_handler(event_type, slack_event)
-        elif re.match('all', slack_event['text']):
-            event_type = 'all'
-            return _event_handler(event_type, slack_event)
-        elif re.match('me', slack_event['text']):
-            event_type = 'me'
-            return _event_handler(event_type, slack_event)
-        elif re.match('new', slack_event['text']):
-            event_type = 'new'
-            return _event_handler(event_type, slack_event)
-
-        # If we hear things that are not events we've subscribed to, send a quirky but helpful error response
-        return make_response('[NO EVENT IN SLACK REQUEST] These are not the droids you\'re looking for.', 404,
-                             {'X-Slack-No-Retry': 1})
+    # if text starts with 'help', send message for more information on how to use command
+    if re.match('help', slack_event['text']):
+        event_type = 'help'
+        return _event_handler(event_type, slack_event)
+    elif re.match('all', slack_event['text']):
+        event_type = 'all'
+        return _event_handler(event_type, slack_event)
+    elif re.match('me', slack_event['text']):
+        event_type = 'me'
+        return _event_handler(event_type, slack_event)
+    elif re.match('new', slack_event['text']):
+        event_type = 'new'
+        return _event_handler(event_type, slack_event)
+
+    # If we hear things that are not events we've subscribed to, send a quirky but helpful error response
+    return make_response('[NO EVENT IN SLACK REQUEST] These are not the droids you\'re looking for.', 404,
+                         {'X-Slack-No-Retry': 1})
+
+
+def _after_change(message, show, *args):
+    """
+    Shows the next event after a user has joined or left one. The change is already saved, so if the database or Slack
+    has become unavailable the user is shown how the change went instead of being asked to try again.
+    :param message: str
+        The result of joining or leaving the event
+    :param show: function
+        Gets the next event to show, e.g. eventBot.get_event
+    :return: The next event, or the message
+    """
+    try:
+        return show(*args)
+    except admission.Unavailable as e:
+        print 'Not showing the next event: %s' % e
+        return message
 
 
 @app.route('/button', methods=['POST'])
+@_verified      # Verify that the request came from Slack
+@admission.controller.guard('/button', _busy, (admission.database,))
+@profiler.profile('/button', _request_user)
 def button_event():
     """
     ============ Slack Message Button Invocation ===========
@@ -151,48 +308,151 @@ def button_event():
     """
     slack_event = json.loads(request.values['payload'])
 
-    # Verify that the request came from Slack
-    response = check_token(slack_event)
-    if not response:
-        try:
-            if slack_event['callback_id'] == 'submit_new_event' and slack_event['actions'][0]['value'] == 'submit':
-                user = slack_event['user']['id']                    # the ID of the Slack user
-                _date = eventBot.messages[user]['date']             # the date of the event
-                _time = eventBot.messages[user]['time']             # the time of the event
-                _text = eventBot.messages[user]['text']             # the description of the event
-                response = eventBot.create_event(_text, _date, _time, user)     # create the event
-                del eventBot.messages[user]                         # delete the temporary event data storage
-            elif slack_event['callback_id'] == 'submit_new_event' and slack_event['actions'][0]['value'] == 'cancel':
-                del eventBot.messages[slack_event['user']['id']]    # delete the temporary event data storage
-                response = eventBot.show_help()            # display a help message so they can properly use the command
-            elif slack_event['callback_id'] == 'get_my_event' and slack_event['actions'][0]['name'] == 'NextEventButton':
-                user = slack_event['user']['id']                    # the ID of the Slack user
-                event_id = slack_event['actions'][0]['value']       # the ID of the event being displayed
-                response = eventBot.get_my_event(user, event_id)    # get the next event
-            elif slack_event['callback_id'] == 'get_event' and slack_event['actions'][0]['name'] == 'NextEventButton':
-                user = slack_event['user']['id']                    # the ID of the Slack user
-                event_id = slack_event['actions'][0]['value']       # the ID of the event being displayed
-                response = eventBot.get_event(user, event_id)       # get the next event
-            elif slack_event['callback_id'] in ('get_event', 'get_my_event') and slack_event['actions'][0]['name'] == 'LeaveEventButton':
-                user = slack_event['user']['id']                    # the ID of the Slack user
-                event_id = slack_event['actions'][0]['value']       # the ID of the event being displayed
-                eventBot.leave_event(user, event_id)                # leave the event
-                response = eventBot.get_event(user, event_id)       # get the next event
-            elif slack_event['callback_id'] == 'get_event' and slack_event['actions'][0]['name'] == 'JoinEventButton':
-                user = slack_event['user']['id']                    # the ID of the Slack user
-                event_id = slack_event['actions'][0]['value']       # the ID of the event being displayed
-                eventBot.join_event(user, event_id)                 # join the event
-                response = eventBot.get_event(user, event_id)       # get the next event
-
-            return make_response(response, 200,)        # send a response back
-        except (KeyError, ValueError) as e:
-            print e.message
-            response = 'Failed to create event'
+    try:
+        if slack_event['callback_id'] == 'submit_new_event' and slack_event['actions'][0]['value'] == 'submit':
+            user = slack_event['user']['id']                    # the ID of the Slack user
+            _date = eventBot.messages[user]['date']             # the date of the event
+            _time = eventBot.messages[user]['time']             # the time of the event
+            _text = eventBot.messages[user]['text']             # the description of the event
+            _rule = eventBot.messages[user]['recurrence']       # how often the event repeats, if at all
+            response = eventBot.create_event(_text, _date, _time, user, _rule)      # create the event
+            del eventBot.messages[user]                         # delete the temporary event data storage
+        elif slack_event['callback_id'] == 'submit_new_event' and slack_event['actions'][0]['value'] == 'cancel':
+            del eventBot.messages[slack_event['user']['id']]    # delete the temporary event data storage
+            response = eventBot.show_help()            # display a help message so they can properly use the command
+        elif slack_event['callback_id'] == 'get_my_event' and slack_event['actions'][0]['name'] == 'NextEventButton':
+            user = slack_event['user']['id']                    # the ID of the Slack user
+            event_id = slack_event['actions'][0]['value']       # the ID of the event being displayed
+            response = eventBot.get_my_event(user, event_id)    # get the next event
+        elif slack_event['callback_id'] == 'get_event' and slack_event['actions'][0]['name'] == 'NextEventButton':
+            user = slack_event['user']['id']                    # the ID of the Slack user
+            event_id = slack_event['actions'][0]['value']       # the ID of the event being displayed
+            response = eventBot.get_event(user, event_id)       # get the next event
+        elif slack_event['callback_id'] == 'get_my_event' and slack_event['actions'][0]['name'] == 'LaterButton':
+            user = slack_event['user']['id']                    # the ID of the Slack user
+            value = slack_event['actions'][0]['value']          # the event and occurrence being displayed
+            response = eventBot.get_my_event(user, value, later=True)   # get the next occurrence of the event
+        elif slack_event['callback_id'] == 'get_event' and slack_event['actions'][0]['name'] == 'LaterButton':
+            user = slack_event['user']['id']                    # the ID of the Slack user
+            value = slack_event['actions'][0]['value']          # the event and occurrence being displayed
+            response = eventBot.get_event(user, value, later=True)      # get the next occurrence of the event
+        elif slack_event['callback_id'] in ('get_event', 'get_my_event') and slack_event['actions'][0]['name'] == 'LeaveEventButton':
+            user = slack_event['user']['id']                    # the ID of the Slack user
+            event_id = slack_event['actions'][0]['value']       # the ID of the event being displayed
+            message = eventBot.leave_event(user, event_id)      # leave the event
+            response = _after_change(message, eventBot.get_event, user, event_id)   # get the next event
+        elif slack_event['callback_id'] == 'get_event' and slack_event['actions'][0]['name'] == 'JoinEventButton':
+            user = slack_event['user']['id']                    # the ID of the Slack user
+            event_id = slack_event['actions'][0]['value']       # the ID of the event being displayed
+            message = eventBot.join_event(user, event_id)       # join the event
+            response = _after_change(message, eventBot.get_event, user, event_id)   # get the next event
+
+        return make_response(response, 200,)        # send a response back
+    except (KeyError, ValueError) as e:
+        print e.message
+        response = 'Failed to create event'
 
     # If our bot hears things that are not events we've subscribed to, send a helpful error response
     return make_response(response, 404, {'X-Slack-No-Retry': 1})
 
 
+@app.route('/export', methods=['GET'])
+def export_events():
+    """
+    ============ Bulk Event Export ===========
+    This route streams every event and its attendees as NDJSON, CSV or iCalendar, depending on the format argument. The
+    request must pass the app's verification token as the token argument.
+    :return: Response object streaming the events, or 403 - Invalid Token / 400 - Unknown Format error
+    """
+    import bulk     # only needed by the bulk routes, so it isn't loaded at startup
+
+    response = check_request_token(request.args)
+    if response:
+        return response
+
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in bulk.FORMATS:
+        return make_response('Unknown format %s, use one of %s' % (fmt, ', '.join(bulk.FORMATS)), 400)
+
+    # the first chunk is read before the response starts, since that opens the database connection and an unavailable
+    # database can still be reported with an error status then
+    stats = {}
+    chunks = bulk.export_events(fmt, stats)
+    try:
+        first = next(chunks)
+    except admission.Unavailable as e:
+        return make_response('%s, please try again later' % e, 503, {'X-Slack-No-Retry': 1})
+
+    def stream():
+        # the events are streamed straight from the database cursor, so the whole export is never held in memory. The
+        # response has already been sent by the time the throughput is known, so it is logged instead
+        yield first
+        for chunk in chunks:
+            yield chunk
+        print 'Exported %(events)d events in %(seconds)s seconds (%(events_per_second)s events per second)' % stats
+
+    return Response(stream_with_context(stream()), mimetype=bulk.MIMETYPES[fmt])
+
+
+@app.route('/import', methods=['POST'])
+def import_events():
+    """
+    ============ Bulk Event Import ===========
+    This route reads events in NDJSON, CSV or iCalendar format from the request body, depending on the format argument,
+    and adds them to the database in batches. The request must pass the app's verification token as the token argument.
+    :return: Response object with 200 - the import statistics, or 403 - Invalid Token / 400 - Unknown Format /
+            503 - Database Unavailable error with the statistics of the batches that were committed before it
+    """
+    import bulk     # only needed by the bulk routes, so it isn't loaded at startup
+
+    response = check_request_token(request.args)
+    if response:
+        return response
+
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in bulk.FORMATS:
+        return make_response('Unknown format %s, use one of %s' % (fmt, ', '.join(bulk.FORMATS)), 400)
+
+    # read the body line by line rather than loading it all at once
+    stats = bulk.import_events(fmt, request.stream)
+    print 'Imported %(events)d events in %(seconds)s seconds (%(events_per_second)s events per second)' % stats
+    if 'error' in stats:
+        return make_response(jsonify(stats), 503, {'X-Slack-No-Retry': 1})
+    return jsonify(stats)
+
+
+@app.route('/admin/profiles', methods=['GET'])
+def list_profiles():
+    """
+    ============ Profiler Captures ===========
+    This route lists the /event and /button requests the profiler has captured, newest first. Pass a user argument to
+    only see the requests of one Slack user. The request must pass the app's verification token as the token argument.
+    :return: Response object with 200 - the list of captures, or 403 - Invalid Token error
+    """
+    response = check_request_token(request.args)
+    if response:
+        return response
+
+    return jsonify({'captures': profiler.summaries(request.args.get('user'))})
+
+
+@app.route('/admin/profiles/stacks', methods=['GET'])
+def profile_stacks():
+    """
+    ============ Profiler Stacks ===========
+    This route returns the stacks sampled from the captured requests in the collapsed format read by flamegraph.pl and
+    speedscope. Pass an id argument to get a single capture, or a user argument to merge all the captures of one Slack
+    user. The request must pass the app's verification token as the token argument.
+    :return: Response object with 200 - the collapsed stacks, or 403 - Invalid Token error
+    """
+    response = check_request_token(request.args)
+    if response:
+        return response
+
+    stacks = profiler.collapsed(request.args.get('id', type=int), request.args.get('user'))
+    return make_response(stacks, 200, {'Content-Type': 'text/plain'})
+
+
 def check_token(slack_event):
     """
     ============ Slack Token Verification ===========
@@ -207,5 +467,20 @@ def check_token(slack_event):
 
     return None
 
+def check_request_token(args):
+    """
+    ============ Request Token Verification ===========
+    The /event and /button requests, and the routes that aren't called by Slack, must pass the app's verification token
+    as the token argument. Unlike check_token, the error never includes the token, since anybody can call these routes.
+    :param args: dict
+            The arguments of the request
+    :return: Responds with None if verification is successful, or a Response object with 403 - Invalid Token error
+    """
+    token = args.get('token', u'').encode('utf-8')
+    if not hmac.compare_digest(token, eventBot.verification.encode('utf-8')):
+        return make_response('Invalid token', 403, {'X-Slack-No-Retry': 1})
+
+    return None
+
 if __name__ == '__main__':
     app.run(debug=True)
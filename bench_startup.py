@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Measures how long a fresh worker takes to import the app and to answer its first /event request. Each run happens in
+a new Python process so nothing is already imported.
+
+Usage:
+	python bench_startup.py [runs]
+"""
+
+from security_fields import *
+import subprocess
+import sys
+
+# the child process prints how long the import and the first request took, in milliseconds
+SCRIPT = """
+import time
+started = time.time()
+import app
+imported = time.time()
+response = app.app.test_client().post('/event', data = {'token': %r, 'text': 'help', 'user_id': 'U0'})
+assert response.status_code == 200, response.status_code
+print('%%f %%f' %% ((imported - started) * 1000, (time.time() - started) * 1000))
+""" % VERIFICATION_TOKEN
+
+
+def run():
+	"""
+	Starts a new interpreter that imports the app and sends it a request.
+	:return: A tuple of the import time and the time to the first response, in milliseconds
+	"""
+	output = subprocess.check_output([sys.executable, '-c', SCRIPT])
+	imported, responded = output.split()
+	return float(imported), float(responded)
+
+
+def summarize(name, timings):
+	"""Prints the fastest, median and slowest of a list of timings."""
+	timings = sorted(timings)
+	print('%-22s min %8.1f ms   median %8.1f ms   max %8.1f ms' % (name, timings[0], timings[len(timings) // 2],
+	                                                              timings[-1]))
+
+
+if __name__ == '__main__':
+	runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+	results = [run() for _ in range(runs)]
+	summarize('import app', [imported for imported, _ in results])
+	summarize('first response', [responded for _, responded in results])
@@ -2,7 +2,10 @@
 """Python Slack Bot class for use with the EventScheduler app"""
 
 from security_fields import *
-from slackclient import SlackClient
+import recurrence
+import directory
+import admission
+import database
 from flask import jsonify
 import re
 from datetime import datetime, date
@@ -19,12 +22,50 @@ class Bot(object):
 		              'client_secret': CLIENT_SECRET,
 		              'scope': 'bot,commands'}
 		self.verification = VERIFICATION_TOKEN
-
-		# Slack requires a client connection to generate an oauth token. We can connect to the client without
-		# authenticating by passing an empty string as a token and then re-instantiating the client with a valid OAuth
-		# token once we have one.
-		self.client = SlackClient(OAUTH_TOKEN)
+		self._client = None     # the Slack client is created the first time it is used, see client
 		self.messages = {}      # so we can easily keep track of event fields when we attempt to create an event
+		self.directory = directory.UserDirectory()      # so we don't have to look up attendee names for every event
+
+	@property
+	def client(self):
+		"""
+		The Slack client. It isn't created until it is first needed, so creating the bot is cheap and a misconfigured
+		Slack app can't stop the application from starting.
+		"""
+		if self._client is None:
+			from slackclient import SlackClient
+
+			# Slack requires a client connection to generate an oauth token. We can connect to the client without
+			# authenticating by passing an empty string as a token and then re-instantiating the client with a valid
+			# OAuth token once we have one.
+			self._client = SlackClient(OAUTH_TOKEN)
+		return self._client
+
+	def _api_call(self, method, **kwargs):
+		"""
+		Calls a Slack API method. Its latency and failures are tracked so that, while Slack is down, requests fail fast
+		with admission.Unavailable instead of waiting for a response.
+		:param method: str
+				The name of the Slack API method
+		:return: The response json message from Slack
+		"""
+		with admission.slack.guard():
+			return self.client.api_call(method, **kwargs)
+
+	def prewarm(self):
+		"""
+		Does the slow parts of the first request ahead of time: creates the Slack client, opens a database connection
+		so the server lookup and login are done, and warms the user directory.
+		"""
+		self.client     # creates the Slack client
+
+		# open up a database connection
+		with database.connect() as db_conn:
+			with db_conn.cursor(as_dict = True) as cursor:
+				cursor.execute('select 1 as Ready')
+				cursor.fetchall()
+
+		self.refresh_directory()
 
 	def auth(self, code):
 		"""
@@ -36,22 +77,50 @@ class Bot(object):
 		"""
 		# After the user has authorized this app for use in their Slack team, Slack returns a temporary authorization
 		# code that we'll exchange for an OAuth token using the oauth.access endpoint
-		self.client.api_call('oauth.access',
-		                     client_id = self.oauth['client_id'],
-		                     client_secret = self.oauth['client_secret'],
-		                     code = code)
+		self._api_call('oauth.access',
+		               client_id = self.oauth['client_id'],
+		               client_secret = self.oauth['client_secret'],
+		               code = code)
 
 		# get the users in the team we just joined and add them to the database
-		users = self.client.api_call('users.list', token = self.client.token)
+		users = self.refresh_directory()
 
 		# open up a database connection
-		with pymssql.connect(server = DB_SERVER, user = DB_USER, password = DB_PASSWORD, database = DB_NAME) as db_conn:
+		with database.connect() as db_conn:
 			with db_conn.cursor(as_dict = True) as cursor:
 				for user in users['members']:
 					if not user['deleted']:     # we don't want to add deleted users
 						cursor.callproc('CreateSlackUser', (user['id'], user['name']))
 			db_conn.commit()    # if you don't commit the changes, the transaction will be rolled back
 
+	def refresh_directory(self):
+		"""
+		Warms the user directory with every user on the team.
+		:return: The response json message from Slack with the list of users
+		"""
+		users = self._api_call('users.list', token = self.client.token)
+		if users['ok']:
+			self.directory.warm(users['members'])
+		return users
+
+	def update_user(self, user):
+		"""
+		Keeps the user directory and the database up to date when a user changes their name.
+		:param user: dict
+				The information on the user who changed their profile
+		"""
+		# Slack sends user_change for any change to a profile, such as a new status or avatar
+		if self.directory.users.get(user['id']) == user['name']:
+			return
+
+		self.directory.update(user)
+
+		# open up a database connection
+		with database.connect() as db_conn:
+			with db_conn.cursor(as_dict = True) as cursor:
+				cursor.callproc('UpdateSlackUser', (user['id'], user['name']))
+			db_conn.commit()    # if you don't commit the changes, the transaction will be rolled back
+
 	def welcome(self, user):
 		"""
 		Create and send a welcome message to new users.
@@ -60,17 +129,18 @@ class Bot(object):
 		:return: The response json message from Slack after posting a message to a channel
 		"""
 		# open up a database connection
-		with pymssql.connect(server = DB_SERVER, database = DB_NAME, user = DB_USER, password = DB_PASSWORD) as db_conn:
+		with database.connect() as db_conn:
 			with db_conn.cursor(as_dict = True) as cursor:
 				cursor.callproc('CreateSlackUser', (user['id'], user['name']))
 			db_conn.commit()    # if you don't commit the changes, the transaction will be rolled back
+		self.directory.update(user)
 
 		# send a welcome message to the user who just joined
-		response = self.client.api_call('chat.postMessage',
-		                                token = self.client.token,
-		                                channel = 'general',
-		                                text = 'Welcome @%s!' % user['name'],
-		                                as_user = False)
+		response = self._api_call('chat.postMessage',
+		                          token = self.client.token,
+		                          channel = 'general',
+		                          text = 'Welcome @%s!' % user['name'],
+		                          as_user = False)
 
 		if response['ok']:
 			return 'Message Sent'
@@ -91,7 +161,10 @@ class Bot(object):
 			        'Just typing `/event` is the same as typing `/event help`\n'
 			        '`/event all` will display all of your events one at a time\n'
 			        '`/event new : Go to Lisa\'s wedding : 3:00 pm : 06/19/17` will create a new event and set a Slack '
-			        'reminder for you at 3 pm on June 6, 2017',
+			        'reminder for you at 3 pm on June 6, 2017\n'
+			        '`/event new : Team standup : 09:30 am : 06/19/17 : weekly until 08/25/17` will create an event that '
+			        'repeats every week. You can also use `daily` or `monthly`, and end the series with `until mm/dd/yy` '
+			        'or `10 times`. Use the Later button to see the next date of a repeating event',
 			'content-type': 'application/json'
 		})
 
@@ -109,13 +182,25 @@ class Bot(object):
 		:return: A json message that displays to the Slack user how the event will be stored, and contains interactive
 				buttons for the user to confirm the event or cancel it.
 		"""
-		_date = datetime.today()
+		rule = recurrence.parse_recurrence(text)    # search for how often the event repeats, if at all
+		text = recurrence.strip_recurrence(text)    # so the date the series ends on isn't taken for the event's date
+
+		_date = date.today()
 		result = re.search(r'(\d+/\d+/\d+)', text)  # search for the date the event occurs on
 
 		if result:
 			temp = datetime.strptime(result.group(0), '%m/%d/%y')
 			_date = date(temp.year, temp.month, temp.day)
 
+		# a series that never occurs would never be displayed, but would still get a reminder
+		if rule and (rule['count'] is not None and rule['count'] < 1 or rule['until'] and rule['until'] < _date):
+			return jsonify({
+				'response_type': 'ephemeral',       # by making this ephemeral, only the user can see it
+				'text': 'A repeating event must happen at least once, and can\'t end before the date it starts on. '
+				        'Type \'/event help\' to see how to properly use EventBot',
+				'content-type': 'application/json'
+			})
+
 		_time = re.search('([0-1][0-9]:[0-5][0-9]) [a|p]m', text)  # search for the time the event occurs at
 		if _time:
 			_time = _time.group()   # make sure a time was found
@@ -127,7 +212,7 @@ class Bot(object):
 		# add the event data to the messages dictionary as a dictionary using the user's ID as the key. We do this
 		# because in the button response, Slack doesn't send this information back to us. This allows us to easily
 		# reference the event data to actually create it
-		self.messages.update({user: {'date': _date, 'time': _time, 'text': description}})
+		self.messages.update({user: {'date': _date, 'time': _time, 'text': description, 'recurrence': rule}})
 
 		# return a json message to confirm the event
 		return jsonify({
@@ -151,6 +236,11 @@ class Bot(object):
 						'title': 'Date',
 						'value': '%d/%d/%d' % (_date.month, _date.day, _date.year),
 						'short': True       # setting this to true makes the fields appear side by side
+					},
+					{
+						'title': 'Repeats',
+						'value': recurrence.describe(rule),
+						'short': True       # setting this to true makes the fields appear side by side
 					}
 				],
 				'actions': [        # add buttons that will enable users to confirm or cancel the event
@@ -172,28 +262,50 @@ class Bot(object):
 			}]
 		})
 
-	def get_event(self, user, event_id = 0):
+	def get_event(self, user, event_id = 0, later = False):
 		"""
 		Gets an event from the database, regardless of who is in it.
 		:param user: str
 				The ID of the Slack user to get events for
 		:param event_id: int
 				The ID of the last event pulled from the database. The default is zero, which will pull the first event
-				in the database.
+				in the database. This can also be the value of the message button that was clicked.
+		:param later: bool
+				Whether to get the next occurrence of the displayed repeating event instead of the next event.
 		:return: A json message containing the info of the next event in the database.
 		"""
 		# open up a database connection
-		with pymssql.connect(server = DB_SERVER, user = DB_USER, password = DB_PASSWORD, database = DB_NAME) as db_conn:
+		with database.connect() as db_conn:
 			with db_conn.cursor(as_dict = True) as cursor:
 				try:
-					cursor.callproc('GetNextEvent', (event_id,))    # get the next event from the database
-					cursor.nextset()
-					event = cursor.fetchall()
-
-					# get the people participating in the event
-					cursor.callproc('GetUsersInEvent', (event[0]['EventID'],))
-					cursor.nextset()
-					names = cursor.fetchall()
+					# repeating events are stored once. The Later button steps to the next occurrence of the displayed
+					# event, and the other buttons move on to the next event in the database, starting from its next occurrence
+					event_id, shown = recurrence.parse_event_value(event_id)
+					displayed = event_id
+					if not later:
+						shown = None
+					elif shown:
+						event_id -= 1       # fetch the displayed event again so we can step to its next occurrence
+
+					while True:
+						cursor.callproc('GetNextEvent', (event_id,))    # get the next event from the database
+						cursor.nextset()
+						event = cursor.fetchall()
+						if not event:
+							raise pymssql.DatabaseError('No events')
+
+						# only the displayed event continues after the occurrence that was shown, others start today
+						if event[0]['EventID'] != displayed:
+							shown = None
+						occurrence = recurrence.next_occurrence(event[0], shown)
+						if occurrence:
+							break
+						event_id = event[0]['EventID']      # the series is over, try the next event
+
+					# get the people participating in the event. They come back as a list of IDs that the user directory
+					# turns into names
+					attendees = event[0]['Attendees'].split(',')
+					names = self.directory.names(attendees, cursor)
 
 					if event and names:     # make sure there are events and people
 						period = 'am'
@@ -205,11 +317,11 @@ class Bot(object):
 
 						names_in_event = ''
 						for name in names:      # put all the names participating in the event into a single string
-							names_in_event += name['Name'] + '\n'
+							names_in_event += name + '\n'
 
 						# is the current user already participating in the event? If so, give the json message a "Leave"
 						# option, otherwise give it a "Join" option
-						if any(name['SlackUserID'] == user for name in names):
+						if user in attendees:
 							return jsonify({
 								'response_type': 'ephemeral',       # by making this ephemeral, only the user can see it
 								'content-type': 'application/json',
@@ -227,7 +339,7 @@ class Bot(object):
 										},
 										{
 											'title': 'Date',
-											'value': event[0]['EventDate'],
+											'value': occurrence.strftime('%Y-%m-%d'),
 											'short': True    # setting this to true makes the fields appear side by side
 										},
 										{
@@ -244,16 +356,16 @@ class Bot(object):
 											'name': 'LeaveEventButton',
 											'text': 'Leave',
 											'type': 'button',
-											'value': event[0]['EventID'],
+											'value': recurrence.event_value(event[0], occurrence),
 										},
 										{
 											'name': 'NextEventButton',
 											'text': 'Next',
 											'type': 'button',
-											'value': event[0]['EventID'],
+											'value': recurrence.event_value(event[0], occurrence),
 											'style': 'primary'      # color indicating proper/improper responses
 										}
-									]
+									] + self._later_button(event[0], occurrence)
 								}]
 							})
 						else:
@@ -274,7 +386,7 @@ class Bot(object):
 										},
 										{
 											'title': 'Date',
-											'value': event[0]['EventDate'],
+											'value': occurrence.strftime('%Y-%m-%d'),
 											'short': True    # setting this to true makes the fields appear side by side
 										},
 										{
@@ -291,16 +403,16 @@ class Bot(object):
 											'name': 'JoinEventButton',
 											'text': 'Join',
 											'type': 'button',
-											'value': event[0]['EventID'],
+											'value': recurrence.event_value(event[0], occurrence),
 										},
 										{
 											'name': 'NextEventButton',
 											'text': 'Next',
 											'type': 'button',
-											'value': event[0]['EventID'],
+											'value': recurrence.event_value(event[0], occurrence),
 											'style': 'primary'      # color indicating proper/improper responses
 										}
-									]
+									] + self._later_button(event[0], occurrence)
 								}]
 							})
 					else:
@@ -314,26 +426,48 @@ class Bot(object):
 						'replace-original': True            # this message will replace the original
 					})
 
-	def get_my_event(self, user, event_id = 0):
+	def get_my_event(self, user, event_id = 0, later = False):
 		"""
 		Gets an event from the database.
 		:param user: str
 				The ID of the Slack user to get events for.
 		:param event_id: int
 				The ID of the last event pulled from the database. The default is zero, which will pull the first event
-				in the database.
+				in the database. This can also be the value of the message button that was clicked.
+		:param later: bool
+				Whether to get the next occurrence of the displayed repeating event instead of the next event.
 		:return: A json message containing the info of the next event in the database.
 		"""
 		# open up a database connection
-		with pymssql.connect(server = DB_SERVER, user = DB_USER, password = DB_PASSWORD, database = DB_NAME) as db_conn:
+		with database.connect() as db_conn:
 			with db_conn.cursor(as_dict = True) as cursor:
 				try:
-					cursor.callproc('GetUserEvent', (user, event_id))
-					cursor.nextset()
-					event = cursor.fetchall()
-					cursor.callproc('GetUsersInEvent', (event[0]['EventID'],))
-					cursor.nextset()
-					names = cursor.fetchall()
+					# repeating events are stored once. The Later button steps to the next occurrence of the displayed
+					# event, and the other buttons move on to the next event the user is in, starting from its next occurrence
+					event_id, shown = recurrence.parse_event_value(event_id)
+					displayed = event_id
+					if not later:
+						shown = None
+					elif shown:
+						event_id -= 1       # fetch the displayed event again so we can step to its next occurrence
+
+					while True:
+						cursor.callproc('GetUserEvent', (user, event_id))
+						cursor.nextset()
+						event = cursor.fetchall()
+						if not event:
+							raise pymssql.DatabaseError('No events')
+
+						# only the displayed event continues after the occurrence that was shown, others start today
+						if event[0]['EventID'] != displayed:
+							shown = None
+						occurrence = recurrence.next_occurrence(event[0], shown)
+						if occurrence:
+							break
+						event_id = event[0]['EventID']      # the series is over, try the next event
+
+					attendees = event[0]['Attendees'].split(',')
+					names = self.directory.names(attendees, cursor)
 
 					if event and names:
 						period = 'am'
@@ -345,7 +479,7 @@ class Bot(object):
 
 						names_in_event = ''
 						for name in names:
-							names_in_event += name['Name'] + '\n'
+							names_in_event += name + '\n'
 
 						return jsonify({
 							'response_type': 'ephemeral',       # by making this ephemeral, only the user can see it
@@ -364,7 +498,7 @@ class Bot(object):
 									},
 									{
 										'title': 'Date',
-										'value': event[0]['EventDate'],
+										'value': occurrence.strftime('%Y-%m-%d'),
 										'short': True    # setting this to true makes the fields appear side by side
 									},
 									{
@@ -381,16 +515,16 @@ class Bot(object):
 										'name': 'LeaveEventButton',
 										'text': 'Leave',
 										'type': 'button',
-										'value': event[0]['EventID'],
+										'value': recurrence.event_value(event[0], occurrence),
 									},
 									{
 										'name': 'NextEventButton',
 										'text': 'Next',
 										'type': 'button',
-										'value': event[0]['EventID'],
+										'value': recurrence.event_value(event[0], occurrence),
 										'style': 'primary'
 									}
-								]
+								] + self._later_button(event[0], occurrence)
 							}]
 						})
 					else:
@@ -404,9 +538,83 @@ class Bot(object):
 						'replace-original': True            # this message will replace the original
 					})
 
-	def create_event(self, description, _date, _time, user):
+	def _later_button(self, event, occurrence):
+		"""
+		Builds the message button that steps to the next occurrence of a repeating event.
+		:param event: dict
+				The event row from the database.
+		:param occurrence: date
+				The occurrence of the event being displayed.
+		:return: A list with the button, or an empty list if the event happens only once.
+		"""
+		if not event['RecurrenceFrequency']:
+			return []
+
+		return [{
+			'name': 'LaterButton',
+			'text': 'Later',
+			'type': 'button',
+			'value': recurrence.event_value(event, occurrence)
+		}]
+
+	def _reminder_time(self, event):
+		"""
+		Gets the unix epoch timestamp of the next occurrence of an event. This is required by Slack to create reminders.
+		:param event: dict
+				The event row from the database.
+		:return: int, or None if the event has no more occurrences.
+		"""
+		occurrence = recurrence.next_occurrence(event)
+		if not occurrence:
+			return None
+
+		return int(time.mktime(time.strptime('%s %s' % (occurrence.strftime('%Y-%m-%d'), event['EventTime']),
+		                                     '%Y-%m-%d %H:%M:%S.0000000')))
+
+	def _reminder_text(self, description, event_id):
 		"""
-		Creates an event in the database and adds a reminder for the user.
+		Builds the text of the Slack reminder for an event. The event ID is part of it so the reminder can be found again
+		when the user leaves the event, whichever occurrence it was set for.
+		:param description: str
+				The description of the event.
+		:param event_id: int
+				The ID of the event.
+		:return: str
+		"""
+		return '%s (event #%d)' % (description.strip(), event_id)
+
+	def _add_reminder(self, user, text, timestamp):
+		"""
+		Creates a Slack reminder for a user who has just created or joined an event. The change is already committed by
+		then, so if Slack is unavailable the user is told the reminder is missing instead of being asked to try again,
+		which would create or join the event a second time.
+		:param user: str
+				The ID of the Slack user to remind.
+		:param text: str
+				The text of the reminder, as built by _reminder_text.
+		:param timestamp: int
+				The unix epoch timestamp to remind the user at.
+		:return: A message saying whether the reminder was created.
+		"""
+		try:
+			response = self._api_call('reminders.add',
+			                          token = self.client.token,
+			                          text = text,
+			                          time = timestamp,
+			                          user = user)
+		except admission.Unavailable as e:
+			print e.message
+			return 'The event was saved, but the reminder could not be set because %s' % e.message
+
+		if response['ok']:
+			return 'Reminder successfully created'
+		else:
+			return 'Failed to create reminder'
+
+	def create_event(self, description, _date, _time, user, rule = None):
+		"""
+		Creates an event in the database and adds a reminder for the user. A repeating event is stored once along with
+		its recurrence rule, and its occurrences are only worked out when they are displayed.
 		:param description: str
 				The description given for the event.
 		:param _date: str
@@ -415,10 +623,13 @@ class Bot(object):
 				The time when the event occurs.
 		:param user: str
 				The ID of the Slack user who is creating the event.
+		:param rule: dict
+				The recurrence rule of the event, as returned by recurrence.parse_recurrence, or None if the event
+				happens only once.
 		:return: The json response that Slack returns when creating a reminder, or an error message.
 		"""
 		# open up a database connection
-		with pymssql.connect(server = DB_SERVER, user = DB_USER, password = DB_PASSWORD, database = DB_NAME) as db_conn:
+		with database.connect() as db_conn:
 			with db_conn.cursor(as_dict = True) as cursor:
 				try:
 					period = re.search('[a|p]m', _time).group()
@@ -436,21 +647,18 @@ class Bot(object):
 					                                                                 int(minute)),
 					                                          '%Y-%m-%d %H-%M-%S')))
 
+					rule = rule or {'frequency': None, 'until': None, 'count': None}
 					cursor.callproc('CreateEvent', (user, description,
 					                                '%d-%d-%d' % (_date.year, _date.month, _date.day),
-					                                '%s:%s:00' % (hour, minute)))
+					                                '%s:%s:00' % (hour, minute),
+					                                rule['frequency'],
+					                                rule['until'] and rule['until'].strftime('%Y-%m-%d'),
+					                                rule['count']))
+					cursor.nextset()
+					event_id = cursor.fetchall()[0]['EventID']
 					db_conn.commit()    # if you don't commit the changes, the transaction will be rolled back
 
-					response = self.client.api_call('reminders.add',
-					                                token = self.client.token,
-					                                text = description,
-					                                time = timestamp,
-					                                user = user)
-
-					if response['ok']:
-						return 'Reminder successfully created'
-					else:
-						return 'Failed to create reminder'
+					return self._add_reminder(user, self._reminder_text(description, event_id), timestamp)
 				except pymssql.DatabaseError as e:
 					print e.message
 					return jsonify({
@@ -466,38 +674,33 @@ class Bot(object):
 		:param user: str
 				The ID of the Slack user to add to the event.
 		:param event_id: int
-				The ID of the event to add the Slack user to.
+				The ID of the event to add the Slack user to, or the value of the message button that was clicked.
 		:return: The json response that Slack returns when creating a reminder, or an error message.
 		"""
+		event_id = recurrence.parse_event_value(event_id)[0]     # users join every occurrence of a repeating event
+
 		# open up a database connection
-		with pymssql.connect(server = DB_SERVER, user = DB_USER, password = DB_PASSWORD, database = DB_NAME) as db_conn:
+		with database.connect() as db_conn:
 			with db_conn.cursor(as_dict = True) as cursor:
 				try:
-					cursor.callproc('AddUserToEvent', (user, event_id))
-					db_conn.commit()        # if you don't commit the changes, the transaction will be rolled back
-
-					cursor.execute('select EventDescription, EventDate, EventTime '
-					               'from [Event] join SlackUserToEvent on [Event].EventID = SlackUserToEvent.EventID '
-					               'where SlackUserID = %s and [Event].EventID = %s', (user, event_id))
+					# the event is read before the user is added, so nothing but the reminder is left to do once the
+					# change is committed
+					cursor.execute('select EventDescription, EventDate, EventTime, RecurrenceFrequency, RecurrenceUntil, '
+					               'RecurrenceCount '
+					               'from [Event] where EventID = %s', (event_id,))
 					event = cursor.fetchall()
 
 					if event:
-						# Get the unix epoch timestamp based on the date and time given.
-						# This is required by Slack to create reminders
-						timestamp = int(time.mktime(time.strptime('%s %s' % (event[0]['EventDate'],
-						                                                     event[0]['EventTime']),
-						                                          '%Y-%m-%d %H:%M:%S.0000000')))
-
-						response = self.client.api_call('reminders.add',
-						                                token = self.client.token,
-						                                text = event[0]['EventDescription'],
-						                                time = timestamp,
-						                                user = user)
-
-						if response['ok']:
-							return 'Reminder successfully created'
-						else:
-							return 'Failed to create reminder'
+						cursor.callproc('AddUserToEvent', (user, event_id))
+						db_conn.commit()    # if you don't commit the changes, the transaction will be rolled back
+
+						# the reminder is for the next occurrence, since a repeating event may have started long ago
+						timestamp = self._reminder_time(event[0])
+						if timestamp is None:
+							return 'The event has no upcoming occurrences to remind you of'
+
+						return self._add_reminder(user, self._reminder_text(event[0]['EventDescription'], event_id),
+						                          timestamp)
 					else:
 						raise pymssql.DatabaseError('Failed to join event')
 				except pymssql.DatabaseError as e:
@@ -509,20 +712,55 @@ class Bot(object):
 						'replace-original': True            # this message will replace the original
 					})
 
+	def _delete_reminder(self, text):
+		"""
+		Deletes the Slack reminder of an event a user has just left. The reminder was set for whichever occurrence was
+		next when the user joined, so it is found by its text, which includes the event ID. The user has already been
+		removed by then, so if Slack is unavailable they are told the reminder is still there instead of being asked
+		to try again.
+		:param text: str
+				The text of the reminder, as built by _reminder_text.
+		:return: A message saying whether the reminder was deleted.
+		"""
+		try:
+			reminders = self._api_call('reminders.list', token = self.client.token)
+
+			message = 'No reminders to delete'
+			if any(reminders['reminders']):
+				_id = next((reminder for reminder in reminders['reminders'] if reminder['text'] == text), None)
+				if _id:
+					response = self._api_call('reminders.delete',
+					                          token = self.client.token,
+					                          reminder = _id['id'])
+
+					if response['ok']:
+						message = 'Reminder successfully deleted'
+					else:
+						message = 'Failed to delete reminder'
+				else:
+					message = 'No reminders to delete'
+
+			return message
+		except admission.Unavailable as e:
+			print e.message
+			return 'You left the event, but the reminder could not be deleted because %s' % e.message
+
 	def leave_event(self, user, event_id):
 		"""
 		Removes a user from an event and creates a Slack reminder.
 		:param user: str
 				The ID of the Slack user to add to the event.
 		:param event_id: int
-				The ID of the event to add the Slack user to.
+				The ID of the event to add the Slack user to, or the value of the message button that was clicked.
 		:return: The json response that Slack returns when creating a reminder, or an error message.
 		"""
+		event_id = recurrence.parse_event_value(event_id)[0]     # users leave every occurrence of a repeating event
+
 		# open up a database connection
-		with pymssql.connect(server = DB_SERVER, user = DB_USER, password = DB_PASSWORD, database = DB_NAME) as db_conn:
+		with database.connect() as db_conn:
 			with db_conn.cursor(as_dict = True) as cursor:
 				try:
-					cursor.execute('select EventDescription, EventDate, EventTime '
+					cursor.execute('select EventDescription '
 					               'from [Event] join SlackUserToEvent on [Event].EventID = SlackUserToEvent.EventID '
 					               'where SlackUserID = %s and [Event].EventID = %s', (user, event_id))
 					event = cursor.fetchall()
@@ -531,31 +769,7 @@ class Bot(object):
 					db_conn.commit()        # if you don't commit the changes, the transaction will be rolled back
 
 					if event:
-						reminders = self.client.api_call('reminders.list', token = self.client.token)
-
-						# Get the unix epoch timestamp based on the date and time given.
-						# This is required by Slack to create reminders
-						timestamp = int(time.mktime(time.strptime('%s %s' % (event[0]['EventDate'],
-						                                                     event[0]['EventTime']),
-						                                          '%Y-%m-%d %H:%M:%S.0000000')))
-						message = 'No reminders to delete'
-						if any(reminders['reminders']):
-							_id = next((reminder for reminder in reminders['reminders']
-							            if reminder['text'] == event[0]['EventDescription'] and reminder['time'] == timestamp),
-							           None)
-							if _id:
-								response = self.client.api_call('reminders.delete',
-								                                token = self.client.token,
-								                                reminder = _id['id'])
-
-								if response['ok']:
-									message = 'Reminder successfully deleted'
-								else:
-									message = 'Failed to delete reminder'
-							else:
-								message = 'No reminders to delete'
-
-						return message
+						return self._delete_reminder(self._reminder_text(event[0]['EventDescription'], event_id))
 					else:
 						raise pymssql.DatabaseError('You could not be added to the event')
 				except pymssql.DatabaseError as e:
@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming bulk import and export of EventScheduler events as NDJSON, CSV or iCalendar. Events are read and written one
+at a time by generators, and imports are committed in batches, so memory use does not grow with the size of the file.
+
+Usage:
+	python bulk.py export --format csv > events.csv
+	python bulk.py import --format ndjson events.ndjson
+"""
+
+import recurrence
+import admission
+import database
+import argparse
+import csv
+import itertools
+import json
+import re
+import sys
+import time
+
+FORMATS = ('ndjson', 'csv', 'ics')
+MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv', 'ics': 'text/calendar'}
+FIELDS = ('description', 'date', 'time', 'frequency', 'until', 'count', 'attendees')
+BATCH_SIZE = 500        # events written per transaction
+
+
+class _Line(object):
+	"""A file-like object that holds the last line a csv writer wrote to it."""
+
+	def write(self, line):
+		self.line = line
+
+
+def _record(rows):
+	"""
+	Builds an export record from the rows of a single event.
+	:param rows: list
+			The rows of the event joined with its attendees, as returned by the export query.
+	:return: A dictionary with the event fields and a list of the attendees' Slack user IDs.
+	"""
+	event = rows[0]
+	until = recurrence.to_date(event['RecurrenceUntil'])
+	return {
+		'description': event['EventDescription'],
+		'date': recurrence.to_date(event['EventDate']).strftime('%Y-%m-%d'),
+		'time': str(event['EventTime'])[:5],
+		'frequency': event['RecurrenceFrequency'],
+		'until': until and until.strftime('%Y-%m-%d'),
+		'count': event['RecurrenceCount'],
+		'attendees': [row['SlackUserID'] for row in rows]
+	}
+
+
+def _ics_escape(text):
+	"""Escapes the characters iCalendar reserves in text values."""
+	return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _ics_unescape(text):
+	"""Reverses _ics_escape in a single pass, so an escaped backslash is never read as the start of another escape."""
+	return re.sub(r'\\(.)', lambda match: '\n' if match.group(1) in 'nN' else match.group(1), text)
+
+
+def _ics_fold(line):
+	"""
+	Folds a content line into lines of at most 75 octets, as RFC 5545 requires, without splitting a UTF-8 character.
+	:param line: str
+			The content line, without its line break.
+	:return: The folded line as UTF-8, with each continuation starting with a space.
+	"""
+	if not isinstance(line, unicode):
+		line = line.decode('utf-8')
+
+	lines, current, size = [], [], 0
+	for character in line:
+		octets = len(character.encode('utf-8'))
+		if size + octets > (75 if not lines else 74):   # continuations lose an octet to the leading space
+			lines.append(''.join(current))
+			current, size = [], 0
+		current.append(character)
+		size += octets
+	lines.append(''.join(current))
+	return '\r\n '.join(lines).encode('utf-8')
+
+
+def _utf8(value):
+	"""Encodes unicode text as UTF-8, since the Python 2 csv module can only write byte strings."""
+	return value.encode('utf-8') if isinstance(value, unicode) else value
+
+
+def write_ndjson(records):
+	"""Yields each record as a line of JSON."""
+	for record in records:
+		yield json.dumps(record) + '\n'
+
+
+def write_csv(records):
+	"""Yields a header line followed by each record as a line of CSV. Attendees are separated by spaces."""
+	line = _Line()
+	writer = csv.writer(line)
+	writer.writerow(FIELDS)
+	yield line.line
+	for record in records:
+		writer.writerow([_utf8(' '.join(record[field]) if field == 'attendees' else record[field]) for field in FIELDS])
+		yield line.line
+
+
+def write_ics(records):
+	"""Yields an iCalendar file with a VEVENT for each record, a few lines at a time."""
+	yield 'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//EventScheduler//Slack EventBot//EN\r\n'
+	for record in records:
+		lines = ['BEGIN:VEVENT',
+		         'DTSTART:%sT%s00' % (record['date'].replace('-', ''), record['time'].replace(':', '')),
+		         'SUMMARY:%s' % _ics_escape(record['description'] or '')]
+		if record['frequency']:
+			rule = 'FREQ=%s' % record['frequency'].upper()
+			if record['until']:
+				rule += ';UNTIL=%s' % record['until'].replace('-', '')
+			if record['count']:
+				rule += ';COUNT=%d' % record['count']
+			lines.append('RRULE:%s' % rule)
+		lines.extend('ATTENDEE:slack:%s' % attendee for attendee in record['attendees'])
+		lines.append('END:VEVENT')
+		yield ''.join(_ics_fold(line) + '\r\n' for line in lines)
+	yield 'END:VCALENDAR\r\n'
+
+
+# The readers yield a ValueError in place of a record they can't decode, so the import can count it as skipped and
+# carry on with the rest of the file.
+
+def read_ndjson(lines):
+	"""Yields a record for each non-empty line of JSON."""
+	for number, line in enumerate(lines, 1):
+		if line.strip():
+			try:
+				record = json.loads(line)
+			except ValueError as e:
+				yield ValueError('Line %d is not valid JSON: %s' % (number, e))
+				continue
+			if isinstance(record, dict):
+				yield record
+			else:
+				yield ValueError('Line %d is not a JSON object' % number)
+
+
+def read_csv(lines):
+	"""Yields a record for each line of CSV after the header. Attendees are separated by spaces."""
+	reader = csv.DictReader(lines)
+	while True:
+		try:
+			row = next(reader)
+		except StopIteration:
+			return
+		except csv.Error as e:
+			yield ValueError('Invalid CSV: %s' % e)
+			continue
+		row['attendees'] = (row.get('attendees') or '').split()
+		yield row
+
+
+def read_ics(lines):
+	"""
+	Yields a record for each VEVENT of an iCalendar file, unfolding continued lines as it goes. A VEVENT that isn't
+	closed before the next one begins, or before the file ends, is yielded as a ValueError.
+	"""
+	def unfold(lines):
+		current = None
+		for line in lines:
+			line = line.rstrip('\r\n')
+			if line[:1] in (' ', '\t') and current is not None:
+				current += line[1:]
+				continue
+			if current is not None:
+				yield current
+			current = line
+		if current is not None:
+			yield current
+
+	record = None
+	for line in unfold(lines):
+		name, _, value = line.partition(':')
+		name = name.split(';')[0].upper()       # ignore parameters such as TZID or CN
+
+		if name == 'BEGIN' and value == 'VEVENT':
+			if record is not None:
+				yield ValueError('Event %r has no END:VEVENT' % record['description'])
+			record = {'description': '', 'date': None, 'time': '00:00', 'frequency': None, 'until': None,
+			          'count': None, 'attendees': []}
+		elif record is None:
+			continue
+		elif name == 'END' and value == 'VEVENT':
+			yield record
+			record = None
+		elif name == 'DTSTART':
+			record['date'] = '%s-%s-%s' % (value[0:4], value[4:6], value[6:8])
+			if 'T' in value:
+				record['time'] = '%s:%s' % (value[9:11], value[11:13])
+		elif name == 'SUMMARY':
+			record['description'] = _ics_unescape(value)
+		elif name == 'RRULE':
+			parts = dict(part.split('=', 1) for part in value.split(';') if '=' in part)
+			record['frequency'] = parts.get('FREQ', '').lower() or None
+			if 'UNTIL' in parts:
+				record['until'] = '%s-%s-%s' % (parts['UNTIL'][0:4], parts['UNTIL'][4:6], parts['UNTIL'][6:8])
+			if 'COUNT' in parts:
+				record['count'] = parts['COUNT']
+		elif name == 'ATTENDEE':
+			record['attendees'].append(value.split(':')[-1])    # strip slack: or mailto: prefixes
+
+	if record is not None:
+		yield ValueError('Event %r has no END:VEVENT' % record['description'])
+
+
+WRITERS = {'ndjson': write_ndjson, 'csv': write_csv, 'ics': write_ics}
+READERS = {'ndjson': read_ndjson, 'csv': read_csv, 'ics': read_ics}
+
+
+def _normalize(record):
+	"""
+	Validates an imported record and converts its fields to the values stored in the database.
+	:param record: dict
+			A record as yielded by one of the readers.
+	:return: A tuple of the Event column values and the list of attendees.
+	:raises ValueError: if the record couldn't be read, is missing fields or has invalid values.
+	"""
+	if isinstance(record, ValueError):
+		raise record
+
+	description = record.get('description')
+	if not description:
+		raise ValueError('Event has no description')
+
+	if not record.get('date'):
+		raise ValueError('Event has no date')
+
+	_date = recurrence.to_date(record['date'])
+	_time = time.strptime(record.get('time') or '00:00', '%H:%M')
+	frequency = record.get('frequency') or None
+	if frequency and frequency not in recurrence.FREQUENCIES:
+		raise ValueError('Unknown recurrence frequency: %s' % frequency)
+	until = recurrence.to_date(record.get('until') or None)
+	count = int(record['count']) if record.get('count') else None
+
+	return ((description[:500], _date.strftime('%Y-%m-%d'), '%02d:%02d:00' % (_time.tm_hour, _time.tm_min),
+	         frequency, until and until.strftime('%Y-%m-%d'), count),
+	        record.get('attendees') or [])
+
+
+def _batches(iterable, size):
+	"""Yields lists of up to size items from an iterable without reading ahead any further."""
+	iterator = iter(iterable)
+	while True:
+		batch = list(itertools.islice(iterator, size))
+		if not batch:
+			return
+		yield batch
+
+
+def _resolve_users(cursor, attendees):
+	"""
+	Looks up a set of attendees in the SlackUser table in as few queries as possible.
+	:param cursor: Cursor
+			An open database cursor.
+	:param attendees: set
+			The Slack user IDs or user names of the attendees.
+	:return: A dictionary mapping every attendee that was found to its Slack user ID.
+	"""
+	users = {}
+	for batch in _batches(sorted(attendees), database.LOOKUP_SIZE):
+		placeholders = ', '.join(['%s'] * len(batch))
+		cursor.execute('select SlackUserID, [Name] from SlackUser '
+		               'where SlackUserID in (%s) or [Name] in (%s)' % (placeholders, placeholders),
+		               tuple(batch) * 2)
+		for user in cursor.fetchall():
+			users[user['SlackUserID']] = user['SlackUserID']
+			users[user['Name']] = user['SlackUserID']
+	return users
+
+
+def export_events(fmt, stats = None):
+	"""
+	Streams every event and its attendees from the database.
+	:param fmt: str
+			One of FORMATS.
+	:param stats: dict
+			If given, it is filled with the number of events written, the time taken and the events per second once
+			the export finishes.
+	:return: A generator of strings in the requested format.
+	"""
+	started = time.time()
+	exported = [0]
+
+	def records(cursor):
+		# rows come back ordered by event, so each event's attendees can be grouped without holding more than one
+		# event in memory
+		cursor.execute('select [Event].EventID, EventDescription, EventDate, EventTime, RecurrenceFrequency, '
+		               'RecurrenceUntil, RecurrenceCount, SlackUserID '
+		               'from [Event] join SlackUserToEvent on [Event].EventID = SlackUserToEvent.EventID '
+		               'order by [Event].EventID')
+		for _, rows in itertools.groupby(cursor, key = lambda row: row['EventID']):
+			exported[0] += 1
+			yield _record(list(rows))
+
+	# open up a database connection
+	with database.connect() as db_conn:
+		with db_conn.cursor(as_dict = True) as cursor:
+			for chunk in WRITERS[fmt](records(cursor)):
+				yield chunk
+
+	if stats is not None:
+		stats.update(_throughput(exported[0], started))
+
+
+def import_events(fmt, lines, batch_size = BATCH_SIZE):
+	"""
+	Reads events from a stream and adds them and their attendees to the database, one transaction per batch.
+	Attendees are matched against the SlackUser table by ID or user name, and events where none of the attendees are
+	known are skipped since they could never be displayed. If the database becomes unavailable the import stops, and
+	only the batches committed before then are counted, so the records after them can be imported again later.
+	:param fmt: str
+			One of FORMATS.
+	:param lines: iterable
+			The lines of the file to import.
+	:param batch_size: int
+			The number of events to write per transaction.
+	:return: A dictionary with the number of events imported and skipped, the number of records read, the time taken
+			and the events per second, and an error if the import stopped early.
+	"""
+	started = time.time()
+	imported, skipped, read = 0, 0, 0
+	error = None
+
+	try:
+		# open up a database connection
+		with database.connect() as db_conn:
+			with db_conn.cursor(as_dict = True) as cursor:
+				for batch in _batches(READERS[fmt](lines), batch_size):
+					events = []
+					batch_skipped = 0
+					for record in batch:
+						try:
+							events.append(_normalize(record))
+						except (KeyError, ValueError, TypeError) as e:
+							print >> sys.stderr, 'Skipping event: %s' % e
+							batch_skipped += 1
+
+					users = _resolve_users(cursor, set(itertools.chain.from_iterable(a for _, a in events)))
+					batch_imported = 0
+					for values, attendees in events:
+						attendees = set(users[attendee] for attendee in attendees if attendee in users)
+						if not attendees:
+							batch_skipped += 1
+							continue
+
+						cursor.execute('insert into [Event] values (%s, %s, %s, %s, %s, %s); '
+						               'select cast(scope_identity() as int) as EventID', values)
+						event_id = cursor.fetchone()['EventID']
+						cursor.executemany('insert into SlackUserToEvent values (%s, %s)',
+						                   [(attendee, event_id) for attendee in attendees])
+						batch_imported += 1
+
+					db_conn.commit()    # if you don't commit the changes, the transaction will be rolled back
+					imported += batch_imported
+					skipped += batch_skipped
+					read += len(batch)
+	except admission.Unavailable as e:
+		print >> sys.stderr, 'Stopping the import after %d records: %s' % (read, e)
+		error = str(e)
+
+	stats = _throughput(imported, started)
+	stats['skipped'] = skipped
+	stats['records'] = read
+	if error:
+		stats['error'] = error
+	return stats
+
+
+def _throughput(events, started):
+	"""Builds the statistics reported after an import or export."""
+	seconds = time.time() - started
+	return {'events': events,
+	        'seconds': round(seconds, 3),
+	        'events_per_second': round(events / seconds, 1) if seconds else 0}
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Import or export EventScheduler events.')
+	parser.add_argument('action', choices = ('import', 'export'))
+	parser.add_argument('file', nargs = '?', help = 'the file to read or write, standard input or output by default')
+	parser.add_argument('--format', choices = FORMATS, default = 'ndjson')
+	parser.add_argument('--batch-size', type = int, default = BATCH_SIZE)
+	args = parser.parse_args()
+
+	if args.action == 'import':
+		with (open(args.file) if args.file else sys.stdin) as stream:
+			result = import_events(args.format, stream, args.batch_size)
+	else:
+		result = {}
+		with (open(args.file, 'w') if args.file else sys.stdout) as stream:
+			for chunk in export_events(args.format, result):
+				stream.write(chunk)
+
+	print >> sys.stderr, json.dumps(result)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Database connections for the EventScheduler app"""
+
+from security_fields import *
+import admission
+import contextlib
+import pymssql
+
+LOOKUP_SIZE = 1000      # values passed to an `in (...)` query at once, which keeps us under the 2100 parameter limit
+
+# only connection and server errors count towards the database's circuit breaker, the rest are handled by the caller
+admission.database.errors = (pymssql.InterfaceError, pymssql.OperationalError)
+
+
+class Connection(object):
+	"""
+	Wraps a pymssql connection so that only the time spent waiting on the server counts as the database's latency, and
+	not whatever the caller does between queries, such as calling the Slack API.
+	"""
+
+	def __init__(self, db_conn):
+		super(Connection, self).__init__()
+		self.db_conn = db_conn
+
+	def cursor(self, *args, **kwargs):
+		"""
+		Creates a cursor whose queries are tracked.
+		:return: Cursor
+		"""
+		return Cursor(self.db_conn.cursor(*args, **kwargs))
+
+	def commit(self):
+		"""
+		Commits the transaction.
+		"""
+		with admission.database.guard():
+			self.db_conn.commit()
+
+
+class Cursor(object):
+	"""Wraps a pymssql cursor so that each query and fetch is tracked by admission.database."""
+
+	def __init__(self, cursor):
+		super(Cursor, self).__init__()
+		self.cursor = cursor
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.cursor.close()
+
+	def __iter__(self):
+		rows = self.fetchmany(LOOKUP_SIZE)      # rows are fetched in batches so each row isn't timed on its own
+		while rows:
+			for row in rows:
+				yield row
+			rows = self.fetchmany(LOOKUP_SIZE)
+
+	def _call(self, method, *args):
+		with admission.database.guard():
+			return getattr(self.cursor, method)(*args)
+
+	def callproc(self, *args):
+		return self._call('callproc', *args)
+
+	def execute(self, *args):
+		return self._call('execute', *args)
+
+	def executemany(self, *args):
+		return self._call('executemany', *args)
+
+	def nextset(self):
+		return self._call('nextset')
+
+	def fetchone(self):
+		return self._call('fetchone')
+
+	def fetchmany(self, size):
+		return self._call('fetchmany', size)
+
+	def fetchall(self):
+		return self._call('fetchall')
+
+
+@contextlib.contextmanager
+def connect():
+	"""
+	Opens up a database connection. The latency and failures of connecting and of each query are tracked so that, while
+	the database is down, requests fail fast with admission.Unavailable instead of waiting for a connection.
+	:return: A context manager for the Connection
+	"""
+	with admission.database.guard():
+		db_conn = pymssql.connect(server = DB_SERVER, user = DB_USER, password = DB_PASSWORD, database = DB_NAME)
+	try:
+		yield Connection(db_conn)
+	finally:
+		db_conn.close()
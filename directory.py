@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""An in-memory directory of Slack user names for the EventScheduler app"""
+
+import database
+import os
+import time
+
+# seconds a cached name is trusted for. A rename only reaches the process that received the user_change event, so the
+# other processes pick it up from the SlackUser table once their copy expires
+TTL = float(os.environ.get('EVENTBOT_DIRECTORY_TTL_S', 300))
+
+
+class UserDirectory(object):
+	"""
+	Caches the name of every Slack user by ID so attendee lists can be stored and fetched as IDs and turned into names
+	without another join. It is warmed from users.list and kept up to date by team_join and user_change events, and
+	names older than ttl seconds are read again from the SlackUser table.
+	"""
+
+	def __init__(self, ttl = TTL, clock = time.time):
+		super(UserDirectory, self).__init__()
+		self.ttl = ttl
+		self.clock = clock
+		self.users = {}     # Slack user ID -> name. Single dictionary operations are atomic, so no lock is needed
+		self.cached = {}    # Slack user ID -> when its name was cached
+
+	def warm(self, members):
+		"""
+		Fills the directory from a list of users.
+		:param members: list
+				The users returned by the users.list Slack API method.
+		"""
+		for user in members:
+			self.update(user)
+
+	def update(self, user):
+		"""
+		Adds or renames a single user. Deactivated users are kept, since they are still listed as attendees of the
+		events they were in and are never removed from the SlackUser table either.
+		:param user: dict
+				The user object Slack sent with users.list, team_join or user_change.
+		"""
+		self.users[user['id']] = user['name']
+		self.cached[user['id']] = self.clock()
+
+	def names(self, user_ids, cursor):
+		"""
+		Gets the names of a list of users. Users that are not in the directory yet, or whose names have expired, are
+		looked up in the SlackUser table in bulk and cached. An expired name is kept if the user can't be found.
+		:param user_ids: list
+				The Slack user IDs to get names for.
+		:param cursor: Cursor
+				An open database cursor used to look up missing users.
+		:return: A list of names, in the same order as the IDs. Users that could not be found are left out.
+		"""
+		now = self.clock()
+		missing = [user_id for user_id in set(user_ids) if user_id not in self.cached or
+		           now - self.cached[user_id] >= self.ttl]
+		for start in range(0, len(missing), database.LOOKUP_SIZE):
+			batch = missing[start:start + database.LOOKUP_SIZE]
+			cursor.execute('select SlackUserID, [Name] from SlackUser where SlackUserID in (%s)' %
+			               ', '.join(['%s'] * len(batch)), tuple(batch))
+			for user in cursor.fetchall():
+				self.users[user['SlackUserID']] = user['Name']
+			for user_id in batch:       # users that weren't found aren't looked up again until ttl has passed either
+				self.cached[user_id] = now
+
+		return [self.users[user_id] for user_id in user_ids if user_id in self.users]
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+An opt-in wall-clock profiler for the EventScheduler routes. It samples the stack of the thread handling a request
+every few milliseconds, and keeps the stacks of a random fraction of requests plus every request slower than a
+threshold in a bounded ring buffer, ready to be turned into flame graphs.
+
+It is configured with environment variables, and is off unless one of the first two is set:
+    EVENTBOT_PROFILE_RATE           fraction of requests to capture, e.g. 0.01
+    EVENTBOT_PROFILE_SLOW_MS        capture every request that takes at least this many milliseconds
+    EVENTBOT_PROFILE_INTERVAL_MS    how often stacks are sampled, 5 by default
+    EVENTBOT_PROFILE_CAPTURES       how many captures to keep, 100 by default
+"""
+import collections
+import functools
+import os
+import random
+import sys
+import threading
+import time
+
+
+def _collapse(frame):
+    """
+    Turns a stack into a line of the collapsed format flame graph tools read, from the outermost frame to the innermost.
+    :param frame: frame
+            The innermost frame of the stack.
+    :return: str like 'app.py:button_event;bot.py:get_event;directory.py:names'
+    """
+    names = []
+    while frame is not None:
+        names.append('%s:%s' % (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler(object):
+    """
+    Samples the stacks of registered threads from a background thread. The background thread only runs while at least
+    one thread is registered.
+    """
+
+    def __init__(self, interval):
+        super(StackSampler, self).__init__()
+        self.interval = interval
+        self._stacks = {}       # thread ident -> Counter of collapsed stacks
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, ident):
+        """
+        Starts sampling a thread.
+        :param ident: int
+                The ident of the thread to sample.
+        """
+        with self._lock:
+            self._stacks[ident] = collections.Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target = self._run, name = 'profiler')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def stop(self, ident):
+        """
+        Stops sampling a thread.
+        :param ident: int
+                The ident of the thread that was being sampled.
+        :return: A Counter of how many times each collapsed stack was seen
+        """
+        with self._lock:
+            return self._stacks.pop(ident)
+
+    def _run(self):
+        """
+        Samples every registered thread until none are left.
+        """
+        me = threading.current_thread().ident
+        while True:
+            with self._lock:
+                if not self._stacks:
+                    self._thread = None     # nothing left to sample, the next start will launch a new thread
+                    return
+                frames = sys._current_frames()
+                for ident, stacks in self._stacks.items():
+                    if ident != me and ident in frames:
+                        stacks[_collapse(frames[ident])] += 1
+            time.sleep(self.interval)
+
+
+class Profiler(object):
+    """Decides which requests to profile and keeps their captures."""
+
+    def __init__(self, sample_rate = 0.0, slow_ms = 0.0, interval_ms = 5.0, capacity = 100):
+        super(Profiler, self).__init__()
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.sampler = StackSampler(interval_ms / 1000.0)
+        self.captures = collections.deque(maxlen = capacity)     # the oldest captures are dropped once it is full
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def profile(self, route, user = None):
+        """
+        Decorates a Flask view so that its requests are profiled.
+        :param route: str
+                The name of the route, stored with each capture.
+        :param user: function
+                Returns the ID of the Slack user who sent the request. It is only called when a capture is kept.
+        :return: The decorator
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                sampled = random.random() < self.sample_rate
+                if not sampled and not self.slow_ms:
+                    return view(*args, **kwargs)
+
+                ident = threading.current_thread().ident
+                self.sampler.start(ident)
+                started = time.time()
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    ms = (time.time() - started) * 1000
+                    stacks = self.sampler.stop(ident)
+                    if sampled or ms >= self.slow_ms:
+                        self._keep(route, self._user(user), started, ms, 'sampled' if sampled else 'slow', stacks)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def _user(user):
+        """
+        Finds the user who sent a request. A request we can't find the user of is still worth keeping, and profiling
+        must never break a request.
+        :param user: function
+                Returns the ID of the Slack user who sent the request.
+        :return: The Slack user ID, or None
+        """
+        try:
+            return user() if user else None
+        except (KeyError, ValueError, TypeError):
+            return None
+
+    def _keep(self, route, user, started, ms, reason, stacks):
+        """
+        Adds a capture to the ring buffer.
+        :param route: str
+                The name of the route that was profiled.
+        :param user: str
+                The Slack user who sent the request.
+        :param started: float
+                When the request started, in seconds since the epoch.
+        :param ms: float
+                How long the request took, in milliseconds.
+        :param reason: str
+                'sampled' or 'slow'.
+        :param stacks: Counter
+                How many times each collapsed stack was seen.
+        """
+        with self._lock:
+            self._next_id += 1
+            self.captures.append({'id': self._next_id,
+                                  'route': route,
+                                  'user': user,
+                                  'started': started,
+                                  'ms': round(ms, 1),
+                                  'reason': reason,
+                                  'stacks': stacks})
+
+    def summaries(self, user = None):
+        """
+        Lists the captures, newest first.
+        :param user: str
+                Only list the captures of this Slack user.
+        :return: A list of dictionaries describing each capture, without its stacks
+        """
+        summaries = []
+        for capture in reversed(list(self.captures)):
+            if user is None or capture['user'] == user:
+                summary = dict((key, value) for key, value in capture.items() if key != 'stacks')
+                summary['samples'] = sum(capture['stacks'].values())
+                summaries.append(summary)
+        return summaries
+
+    def collapsed(self, capture_id = None, user = None):
+        """
+        Merges the stacks of the matching captures into the collapsed format read by flamegraph.pl and speedscope.
+        :param capture_id: int
+                Only include this capture.
+        :param user: str
+                Only include the captures of this Slack user.
+        :return: str with a 'stack count' line for each stack
+        """
+        stacks = collections.Counter()
+        for capture in list(self.captures):
+            if (capture_id is None or capture['id'] == capture_id) and (user is None or capture['user'] == user):
+                stacks.update(capture['stacks'])
+        return ''.join('%s %d\n' % (stack, count) for stack, count in sorted(stacks.items()))
+
+
+profiler = Profiler(float(os.environ.get('EVENTBOT_PROFILE_RATE', 0)),
+                    float(os.environ.get('EVENTBOT_PROFILE_SLOW_MS', 0)),
+                    float(os.environ.get('EVENTBOT_PROFILE_INTERVAL_MS', 5)),
+                    int(os.environ.get('EVENTBOT_PROFILE_CAPTURES', 100)))
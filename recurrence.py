@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""Recurrence rules for EventScheduler events, expanded lazily into occurrence dates"""
+
+import calendar
+import re
+from datetime import datetime, date, timedelta
+
+FREQUENCIES = ('daily', 'weekly', 'monthly')
+
+# a trailing `: weekly`, `: daily until 06/30/17` or `: monthly 6 times` field of the /event command
+RULE = re.compile(r':\s*(daily|weekly|monthly)(?:\s+until\s+(\d+/\d+/\d+))?(?:\s+(\d+)\s+times)?\s*$', re.I)
+
+
+def to_date(value):
+	"""
+	Converts a date as returned by the database into a date object.
+	:param value: str or date
+			A date object, or a string starting with a yyyy-mm-dd date.
+	:return: The date, or None if no value was given.
+	"""
+	if value is None or isinstance(value, date):
+		return value
+	return datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+
+def parse_recurrence(text):
+	"""
+	Searches the arguments of the /event command for a trailing recurrence rule, e.g. `: weekly`,
+	`: daily until 06/30/17` or `: monthly 6 times`.
+	:param text: str
+			The arguments the Slack user gave to the /event command.
+	:return: A dictionary with the frequency, the date the series ends on and the number of occurrences, or None if the
+			event does not repeat.
+	"""
+	result = RULE.search(text)
+	if not result:
+		return None
+
+	until = None
+	if result.group(2):
+		until = datetime.strptime(result.group(2), '%m/%d/%y').date()
+	count = int(result.group(3)) if result.group(3) else None
+
+	return {'frequency': result.group(1).lower(), 'until': until, 'count': count}
+
+
+def strip_recurrence(text):
+	"""
+	Removes the trailing recurrence rule from the arguments of the /event command, so the date a series ends on isn't
+	mistaken for the date of the event.
+	:param text: str
+			The arguments the Slack user gave to the /event command.
+	:return: The arguments without the recurrence rule.
+	"""
+	return RULE.sub('', text)
+
+
+def describe(rule):
+	"""
+	Builds a short human readable summary of a recurrence rule.
+	:param rule: dict
+			The recurrence rule, as returned by parse_recurrence.
+	:return: A string like 'Weekly until 6/30/2017', or 'Never' if there is no rule.
+	"""
+	if not rule:
+		return 'Never'
+
+	summary = rule['frequency'].capitalize()
+	if rule['until']:
+		summary += ' until %d/%d/%d' % (rule['until'].month, rule['until'].day, rule['until'].year)
+	if rule['count']:
+		summary += ', %d times' % rule['count']
+	return summary
+
+
+def _nth(start, frequency, n):
+	"""Gets the date of the nth occurrence (counting from zero) of a series starting on start."""
+	if frequency == 'daily':
+		return start + timedelta(days = n)
+	elif frequency == 'weekly':
+		return start + timedelta(weeks = n)
+
+	# monthly events stay on the same day of the month, or the last day of shorter months
+	month = start.month - 1 + n
+	year = start.year + month // 12
+	month = month % 12 + 1
+	return date(year, month, min(start.day, calendar.monthrange(year, month)[1]))
+
+
+def _first_index_after(start, frequency, after):
+	"""Gets the index of the first occurrence that falls after the given date without walking the series."""
+	if after < start:
+		return 0
+	elif frequency == 'daily':
+		return (after - start).days + 1
+	elif frequency == 'weekly':
+		return (after - start).days // 7 + 1
+
+	n = (after.year - start.year) * 12 + after.month - start.month
+	if _nth(start, frequency, n) <= after:
+		n += 1
+	return n
+
+
+def occurrences(start, frequency = None, until = None, count = None, after = None, before = None):
+	"""
+	Lazily yields the dates an event occurs on. Only the occurrences inside the requested window are ever computed, so
+	a series is never materialized.
+	:param start: date
+			The date of the first occurrence.
+	:param frequency: str
+			One of 'daily', 'weekly' or 'monthly', or None if the event happens only once.
+	:param until: date
+			The last date the series may occur on, or None.
+	:param count: int
+			The total number of occurrences in the series, or None.
+	:param after: date
+			Only yield occurrences after this date.
+	:param before: date
+			Stop before this date. If neither this, until nor count is given the generator never ends.
+	"""
+	if frequency is None:
+		count = 1
+	elif frequency not in FREQUENCIES:
+		raise ValueError('Unknown recurrence frequency: %s' % frequency)
+
+	n = _first_index_after(start, frequency or 'daily', after) if after else 0
+	while count is None or n < count:
+		occurrence = _nth(start, frequency or 'daily', n)
+		if (until and occurrence > until) or (before and occurrence >= before):
+			return
+		yield occurrence
+		n += 1
+
+
+def next_occurrence(event, after = None):
+	"""
+	Gets the next occurrence of an event row from the database.
+	:param event: dict
+			The event row, including its EventDate and Recurrence columns.
+	:param after: date
+			The occurrence that was last displayed. If None, a repeating event starts from today, and an event that
+			happens once is always returned.
+	:return: The date of the next occurrence, or None if the event has no more occurrences.
+	"""
+	start = to_date(event['EventDate'])
+	frequency = event.get('RecurrenceFrequency')
+	if not frequency:
+		return start if after is None else None
+
+	if after is None:
+		after = date.today() - timedelta(days = 1)
+	return next(occurrences(start, frequency, to_date(event.get('RecurrenceUntil')), event.get('RecurrenceCount'),
+	                        after), None)
+
+
+def event_value(event, occurrence):
+	"""
+	Builds the value passed on the message buttons of an event so the next button click knows which occurrence of which
+	event was displayed.
+	:param event: dict
+			The event row from the database.
+	:param occurrence: date
+			The occurrence of the event being displayed.
+	:return: The event ID, or 'EventID:yyyy-mm-dd' for repeating events.
+	"""
+	if not event.get('RecurrenceFrequency'):
+		return event['EventID']
+	return '%d:%s' % (event['EventID'], occurrence.strftime('%Y-%m-%d'))
+
+
+def parse_event_value(value):
+	"""
+	Splits a message button value built by event_value.
+	:param value: str or int
+			The value of the clicked message button.
+	:return: A tuple of the event ID and the occurrence that was displayed, or None if the event does not repeat.
+	"""
+	value = str(value)
+	if ':' not in value:
+		return int(value), None
+	event_id, occurrence = value.split(':', 1)
+	return int(event_id), to_date(occurrence)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""Tests for the overload protection in admission.py, driven by a fake clock so latency can be injected"""
+
+import admission
+import unittest
+
+
+class FakeClock(object):
+    """Stands in for time.time, only moving when a test says so."""
+
+    def __init__(self):
+        super(FakeClock, self).__init__()
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class Down(Exception):
+    """The error a fake dependency raises when it is down."""
+
+
+class AdmissionControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.controller = admission.AdmissionController(max_in_flight = 2, latency_budget = 1.0, clock = self.clock)
+
+    def request(self, route, seconds, dependencies = ()):
+        """Makes a request that takes the given number of seconds."""
+        with self.controller.admit(route, dependencies):
+            self.clock.advance(seconds)
+
+    def test_sheds_when_in_flight_reaches_limit(self):
+        with self.controller.admit('/event'):
+            with self.controller.admit('/event'):
+                self.assertEqual(self.controller.routes['/event'].in_flight, 2)
+                with self.assertRaises(admission.Unavailable):
+                    with self.controller.admit('/event'):
+                        pass
+                with self.controller.admit('/button'):     # each route has its own limit
+                    pass
+            with self.controller.admit('/event'):          # a finished request makes room for another
+                pass
+        self.assertEqual(self.controller.routes['/event'].in_flight, 0)
+
+    def test_limit_shrinks_when_latency_is_over_budget(self):
+        self.request('/event', 0.5)
+        self.assertEqual(self.controller.limit('/event'), 2)
+
+        self.request('/event', 4.0)
+        stats = self.controller.routes['/event']
+        self.assertAlmostEqual(stats.latency, 0.2 * 4.0 + 0.8 * 0.5)
+        self.assertEqual(self.controller.limit('/event'), 1)
+
+        with self.controller.admit('/event'):
+            with self.assertRaises(admission.Unavailable):
+                with self.controller.admit('/event'):
+                    pass
+
+    def test_limit_shrinks_when_a_dependency_is_slow(self):
+        database = admission.Dependency('The database', clock = self.clock)
+        with database.guard():
+            self.clock.advance(3.0)
+
+        self.assertEqual(self.controller.limit('/event'), 2)
+        self.assertEqual(self.controller.limit('/event', (database,)), 1)
+        with self.controller.admit('/event', (database,)):
+            with self.assertRaises(admission.Unavailable):
+                with self.controller.admit('/event', (database,)):
+                    pass
+
+    def test_sheds_when_a_dependency_is_unavailable(self):
+        database = admission.Dependency('The database', errors = (Down,), failures = 1, clock = self.clock)
+        with self.assertRaises(Down):
+            with database.guard():
+                raise Down()
+
+        with self.assertRaises(admission.Unavailable):
+            with self.controller.admit('/button', (database,)):
+                pass
+        self.assertEqual(self.controller.routes['/button'].in_flight, 0)
+
+    def test_guard_returns_busy_reply(self):
+        replies = []
+
+        def busy(error):
+            replies.append(error)
+            return 'busy'
+
+        @self.controller.guard('/event', busy)
+        def view():
+            return 'ok'
+
+        self.assertEqual(view(), 'ok')
+        with self.controller.admit('/event'):
+            with self.controller.admit('/event'):
+                self.assertEqual(view(), 'busy')
+        self.assertEqual(len(replies), 1)
+        self.assertIsInstance(replies[0], admission.Unavailable)
+        self.assertEqual(view(), 'ok')
+
+    def test_guard_asks_for_the_dependencies_of_each_request(self):
+        database = admission.Dependency('The database', errors = (Down,), failures = 1, clock = self.clock)
+        with self.assertRaises(Down):
+            with database.guard():
+                raise Down()
+
+        needs = [()]
+
+        @self.controller.guard('/event', lambda error: 'busy', lambda: needs[0])
+        def view():
+            return 'ok'
+
+        self.assertEqual(view(), 'ok')      # a request that doesn't need the database isn't shed
+        needs[0] = (database,)
+        self.assertEqual(view(), 'busy')
+
+
+class DependencyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.dependency = admission.Dependency('Slack', errors = (Down,), failures = 3, reset_after = 30.0,
+                                               clock = self.clock)
+
+    def call_failing(self):
+        with self.assertRaises(Down):
+            with self.dependency.guard():
+                raise Down()
+
+    def test_opens_after_failures_in_a_row(self):
+        self.call_failing()
+        self.call_failing()
+        self.assertEqual(self.dependency.state, 'closed')
+        self.call_failing()
+        self.assertEqual(self.dependency.state, 'open')
+        self.assertFalse(self.dependency.available())
+        with self.assertRaises(admission.Unavailable):
+            with self.dependency.guard():
+                pass
+
+    def test_other_errors_do_not_count(self):
+        for _ in range(5):
+            with self.assertRaises(KeyError):
+                with self.dependency.guard():
+                    raise KeyError()
+        self.assertEqual(self.dependency.state, 'closed')
+
+    def test_half_open_allows_one_trial_that_closes_it(self):
+        for _ in range(3):
+            self.call_failing()
+        self.clock.advance(30.0)
+        self.assertEqual(self.dependency.state, 'half-open')
+        self.assertTrue(self.dependency.available())
+
+        with self.dependency.guard():
+            self.assertFalse(self.dependency.available())
+            with self.assertRaises(admission.Unavailable):      # only one trial call at a time
+                with self.dependency.guard():
+                    pass
+        self.assertEqual(self.dependency.state, 'closed')
+        self.assertEqual(self.dependency.failures, 0)
+
+    def test_failed_trial_reopens_it(self):
+        for _ in range(3):
+            self.call_failing()
+        self.clock.advance(30.0)
+        self.call_failing()
+        self.assertEqual(self.dependency.state, 'open')
+
+        self.clock.advance(29.0)
+        self.assertEqual(self.dependency.state, 'open')
+        self.clock.advance(1.0)
+        self.assertEqual(self.dependency.state, 'half-open')
+
+    def test_records_latency(self):
+        with self.dependency.guard():
+            self.clock.advance(0.25)
+        self.assertEqual(self.dependency.stats.latency, 0.25)
+        self.assertEqual(self.dependency.stats.in_flight, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()